@@ -8,8 +8,12 @@ import cv2
 import numpy as np
 from attr import dataclass
 
+from .codec import make_codecs
+from .ingest import IngestQueue
+from .journal import JournalWriter, encode_varint, is_observation_update
 from .protobuf.game_socket_pb2 import *
 from .session_storage import SessionStorage
+from .world_state import BALL, TANK, WorldState
 
 
 def decode_image(image_message):
@@ -32,6 +36,23 @@ def decode_image(image_message):
         )
 
 
+def encode_image(image: np.ndarray) -> Image:
+    """Inverse of `decode_image`, BGRA frames become raw images and BGR frames PNGs."""
+    height, width, channels = image.shape
+
+    if channels == 4:
+        rgba = cv2.cvtColor(image, cv2.COLOR_BGRA2RGBA)
+        return Image(
+            raw_image=RawRgbaImage(width=width, height=height, data=rgba.tobytes())
+        )
+
+    success, png_data = cv2.imencode(".png", image)
+    if not success:
+        raise ValueError(f"Failed to encode image of shape {image.shape}")
+
+    return Image(png_image=PngImage(data=png_data.tobytes()))
+
+
 @dataclass
 class Entity:
     entity: int
@@ -52,16 +73,32 @@ class NoTankAssignedException(Exception): ...
 class GameClient:
     entity_states: dict[int, dict[str, Any]]
 
-    def __init__(self, address=("localhost", 7878)):
+    def __init__(
+        self,
+        address=("localhost", 7878),
+        storage: SessionStorage | None = None,
+        journal: JournalWriter | None = None,
+        ingest_queue_size: int | None = None,
+        receive_buffer_size: int = 1 << 20,
+    ):
         self.address = address
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.lock = threading.Lock()
 
+        # When journaling, observation updates are only appended to the journal,
+        # so there is no session storage unless one is given
+        self.journal = journal
+        if storage is None and journal is None:
+            storage = SessionStorage(mode="a")
+
         # Tank-related state tracking
         # tank_id -> {'image': ..., 'reward': ..., 'sensors': ...}
-        self.storage = SessionStorage(mode="a")
+        self.storage: SessionStorage | None = storage
         self.tank_turrets = {}
         self.balls = {}
+
+        # Latest position and rotation of every known tank and ball
+        self.world = WorldState()
         self.alive_tanks = set()
         self.dead_tanks = set()
         self.assigned_tanks = set()  # Set of tank IDs assigned to this client
@@ -72,10 +109,32 @@ class GameClient:
         # Asynchronous message handling
         self.running = False
         self.receive_thread = None
-        self.message_queue = queue.Queue()
+
+        # With an ingest queue, messages are processed on their own thread, so
+        # a slow storage drops stale observations instead of stalling the socket
+        self.process_thread = None
+        self.message_queue: IngestQueue | None = None
+        if ingest_queue_size is not None:
+            self.message_queue = IngestQueue(maxsize=ingest_queue_size)
+
+        # Frames are read out of a reused buffer, which takes one syscall for
+        # many small frames instead of a few per frame
+        self.receive_buffer = bytearray(receive_buffer_size)
+        self.receive_view = memoryview(self.receive_buffer)
+        self.receive_start = 0
+        self.receive_end = 0
+
+        # Decoding state, reused for every message
+        self.server_message = ServerMessage()
+        self.codecs = make_codecs()
 
     def connect(self):
-        self.storage.open()
+        if self.storage is not None:
+            self.storage.open()
+
+        if self.journal is not None:
+            self.journal.open()
+
         self.sock.connect(self.address)
         self.request_tank_list()
         self.request_ball_list()
@@ -88,6 +147,14 @@ class GameClient:
         )
         self.receive_thread.start()
 
+        if self.message_queue is not None:
+            self.process_thread = threading.Thread(
+                target=process_queued_messages,
+                args=(self,),
+                daemon=True,
+            )
+            self.process_thread.start()
+
     def __enter__(self):
         self.connect()
         return self
@@ -98,75 +165,133 @@ class GameClient:
     def close(self):
         self.running = False
         self.sock.close()
-        self.storage.__exit__()
 
-    def send_message(self, client_message: ClientMessage) -> None:
-        serialized_message = client_message.SerializeToString()
-        varint_buf = []
+        # Let the processing thread finish the (bounded) pending messages
+        if self.message_queue is not None:
+            self.message_queue.close()
+            if self.process_thread is not None:
+                self.process_thread.join()
 
-        number = len(serialized_message)
-        while number >> 7:
-            varint_buf.append(number & 0x7F | 0x80)
-            number >>= 7
+        if self.storage is not None:
+            self.storage.__exit__()
 
-        varint_buf.append(number)
+        if self.journal is not None:
+            self.journal.close()
 
-        self.sock.sendall(bytes(varint_buf))
+    def send_message(self, client_message: ClientMessage) -> None:
+        serialized_message = client_message.SerializeToString()
+        self.sock.sendall(encode_varint(len(serialized_message)))
         self.sock.sendall(serialized_message)
 
-    def receive_message(self) -> ServerMessage | None:
+    def _receive(self, size: int) -> None:
+        """Buffer at least `size` bytes, reading as much as the socket has."""
+        if self.receive_start + size > len(self.receive_buffer):
+            # Move the pending bytes to the front, to make room for the rest
+            pending = self.receive_end - self.receive_start
+            self.receive_view[:pending] = self.receive_view[
+                self.receive_start : self.receive_end
+            ]
+            self.receive_start, self.receive_end = 0, pending
+
+        while self.receive_end - self.receive_start < size:
+            count = self.sock.recv_into(self.receive_view[self.receive_end :])
+            if not count:
+                raise ConnectionAbortedError
+
+            self.receive_end += count
+
+    def receive_frame(self) -> bytearray:
         shift = 0
         length = 0
         while True:
-            inp = self.sock.recv(1)
-            if not inp:
-                raise ConnectionAbortedError
+            if self.receive_start == self.receive_end:
+                self._receive(1)
 
-            [i] = inp
+            i = self.receive_buffer[self.receive_start]
+            self.receive_start += 1
             length |= (i & 0x7F) << shift
             shift += 7
             if not (i & 0x80):
                 break
 
-        message_data = self.sock.recv(length)
+        if length <= len(self.receive_buffer):
+            self._receive(length)
+            start = self.receive_start
+            self.receive_start += length
+            return self.receive_buffer[start : self.receive_start]
+
+        # Larger than the buffer, receive the rest straight into the frame
+        message_data = bytearray(length)
+        view = memoryview(message_data)
+        received = self.receive_end - self.receive_start
+        view[:received] = self.receive_view[self.receive_start : self.receive_end]
+        self.receive_start = self.receive_end = 0
+
+        while received < length:
+            count = self.sock.recv_into(view[received:])
+            if not count:
+                raise ConnectionAbortedError
+
+            received += count
+
+        return message_data
+
+    def receive_message(self) -> ServerMessage | None:
+        message_data = self.receive_frame()
 
         if not message_data:
             return None
 
-        return ServerMessage.FromString(message_data)
+        if self.journal is not None:
+            self.journal.append(message_data)
+
+            # Only the control messages need to be parsed while journaling
+            if is_observation_update(message_data):
+                return None
+
+        # Queued messages outlive the next call, others are only valid until then
+        message = self.server_message if self.message_queue is None else ServerMessage()
+        message.ParseFromString(message_data)
+        return message
 
     def process_server_message(self, message: ServerMessage):
-        if message.HasField("tank_spawned"):
+        message_kind = message.WhichOneof("message")
+
+        if message_kind == "observation_update":
+            self.handle_observation_update(message.observation_update)
+
+        elif message_kind == "tank_spawned":
             self.handle_tank_spawned(message.tank_spawned)
 
-        elif message.HasField("tank_died"):
+        elif message_kind == "tank_died":
             self.handle_tank_died(message.tank_died)
 
-        elif message.HasField("tank_assigned"):
+        elif message_kind == "tank_assigned":
             self.handle_tank_assigned(message.tank_assigned)
 
-        elif message.HasField("tank_list"):
+        elif message_kind == "tank_list":
             self.handle_tank_list(message.tank_list)
 
-        elif message.HasField("ball_list"):
+        elif message_kind == "ball_list":
             self.handle_ball_list(message.ball_list)
 
-        elif message.HasField("observation_update"):
-            self.handle_observation_update(message.observation_update)
-
         else:
             print(f"Unhandled message from server: {message}")
 
     def handle_tank_spawned(self, tank: Tank):
         self.alive_tanks.add(tank.tank_id)
+        self.world.set_kind(tank.tank_id, TANK)
 
         dtype = [("turret_id", np.uint64)]
         turrets = np.asarray([turret.turret_id for turret in tank.turrets], dtype=dtype)
-        self.storage.entity_data(tank.tank_id)["turrets"] = turrets
+        self.tank_turrets[tank.tank_id] = turrets
+        if self.storage is not None:
+            self.storage.entity_data(tank.tank_id)["turrets"] = turrets
 
     def handle_tank_died(self, tank_id: int):
         self.dead_tanks.add(tank_id)
         self.alive_tanks.discard(tank_id)
+        self.world.remove(tank_id)
         self.assigned_tanks.discard(tank_id)
 
     def handle_tank_assigned(self, tank_id):
@@ -179,39 +304,44 @@ class GameClient:
                 self.handle_tank_spawned(tank)
 
     def handle_ball_list(self, ball_list: BallList):
-        self.balls = {ball.ball_id: ball for ball in ball_list.balls}
+        # Copied, since the received message is reused
+        balls = {ball.ball_id: Ball(ball_id=ball.ball_id) for ball in ball_list.balls}
+
+        for ball_id in self.balls.keys() - balls.keys():
+            self.world.remove(ball_id)
+
+        for ball_id in balls:
+            self.world.set_kind(ball_id, BALL)
+
+        self.balls = balls
 
     def handle_observation_update(self, update: ObservationUpdate):
         data_kind = update.WhichOneof("observation")
+        codec = self.codecs.get(data_kind)
 
-        if data_kind == "image":
-            array = decode_image(update.image)
+        if codec is not None:
+            record = codec.decode(update)
+            self.storage.add_record(update.entity, data_kind, record)
 
-        elif data_kind == "reward":
-            array = np.asarray(update.reward.reward, dtype=np.float64)
+            # An update still in flight when the tank died must not bring it back
+            if update.entity in self.dead_tanks:
+                return
 
-        elif data_kind == "position":
-            array = np.asarray(
-                (update.position.x, update.position.y),
-                dtype=np.dtype([("x", np.float32), ("y", np.float32)]),
-            )
+            if data_kind == "position":
+                position = update.position
+                self.world.update_position(
+                    update.entity, update.timestamp, position.x, position.y
+                )
 
-        elif data_kind == "tank_controls":
-            array = np.asarray(
-                (update.tank_controls.right_engine, update.tank_controls.left_engine),
-                dtype=np.dtype(
-                    [("right_engine", np.float32), ("left_engine", np.float32)]
-                ),
-            )
+            elif data_kind == "rotation_in_radians":
+                self.world.update_rotation(
+                    update.entity, update.timestamp, update.rotation_in_radians
+                )
 
-        elif data_kind == "turret_controls":
-            array = np.asarray(
-                (update.turret_controls.rotation_speed, update.turret_controls.count),
-                dtype=np.dtype([("rotation_speed", np.float32), ("count", np.int32)]),
-            )
+            return
 
-        elif data_kind == "rotation_in_radians":
-            array = np.asarray(update.rotation_in_radians, dtype=np.float32)
+        if data_kind == "image":
+            array = decode_image(update.image)
 
         else:
             warn(f"Unexpected observation kind: {data_kind}")
@@ -295,9 +425,15 @@ def read_server_messages(client: GameClient):
     try:
         while client.running:
             message = client.receive_message()
-            if message:
+            if not message:
+                continue
+
+            if client.message_queue is None:
                 client.process_server_message(message)
 
+            else:
+                client.message_queue.put(message)
+
     except ConnectionAbortedError:
         pass
 
@@ -306,3 +442,22 @@ def read_server_messages(client: GameClient):
 
     finally:
         client.running = False
+        if client.message_queue is not None:
+            client.message_queue.close()
+
+
+def process_queued_messages(client: GameClient):
+    try:
+        while (message := client.message_queue.get()) is not None:
+            client.process_server_message(message)
+
+    finally:
+        # Stop the receive thread too, it may be blocked on the full queue or the
+        # socket, instead of leaving the client running without processing
+        client.running = False
+        client.message_queue.close()
+        try:
+            client.sock.shutdown(socket.SHUT_RDWR)
+
+        except OSError:
+            pass
@@ -0,0 +1,68 @@
+from typing import Any, Callable
+
+import numpy as np
+
+from .protobuf.game_socket_pb2 import ObservationUpdate
+
+# Value dtypes of the scalar observation kinds, as stored in their tables
+POSITION_DTYPE = np.dtype([("x", np.float32), ("y", np.float32)])
+TANK_CONTROLS_DTYPE = np.dtype(
+    [("right_engine", np.float32), ("left_engine", np.float32)]
+)
+TURRET_CONTROLS_DTYPE = np.dtype([("rotation_speed", np.float32), ("count", np.int32)])
+
+VALUE_DTYPES: dict[str, np.dtype] = {
+    "reward": np.dtype(np.float64),
+    "position": POSITION_DTYPE,
+    "tank_controls": TANK_CONTROLS_DTYPE,
+    "turret_controls": TURRET_CONTROLS_DTYPE,
+    "rotation_in_radians": np.dtype(np.float32),
+}
+
+# Read the value of each kind out of an update, as a scalar or a record tuple
+VALUE_READERS: dict[str, Callable[[ObservationUpdate], Any]] = {
+    "reward": lambda update: update.reward.reward,
+    "position": lambda update: (update.position.x, update.position.y),
+    "tank_controls": lambda update: (
+        update.tank_controls.right_engine,
+        update.tank_controls.left_engine,
+    ),
+    "turret_controls": lambda update: (
+        update.turret_controls.rotation_speed,
+        update.turret_controls.count,
+    ),
+    "rotation_in_radians": lambda update: update.rotation_in_radians,
+}
+
+
+def record_dtype(component: str, value_dtype: np.dtype, shape=()) -> np.dtype:
+    """Dtype of a table row, the same layout `SessionStorage.add_row` stores."""
+    return np.dtype([("timestamp", np.uint64), (component, value_dtype, shape)])
+
+
+RECORD_DTYPES: dict[str, np.dtype] = {
+    kind: record_dtype(kind, dtype) for kind, dtype in VALUE_DTYPES.items()
+}
+
+
+class RecordCodec:
+    """Decodes updates of one scalar observation kind into a reused table row.
+
+    The returned record is overwritten by the next call to `decode`, so it
+    must be stored (copied) before decoding the next update.
+    """
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.dtype = RECORD_DTYPES[kind]
+        self.read = VALUE_READERS[kind]
+        self.record = np.zeros((), dtype=self.dtype)
+
+    def decode(self, update: ObservationUpdate) -> np.ndarray:
+        self.record[()] = (update.timestamp, self.read(update))
+        return self.record
+
+
+def make_codecs() -> dict[str, RecordCodec]:
+    """One codec per scalar kind, a set of codecs must only be used by one thread."""
+    return {kind: RecordCodec(kind) for kind in RECORD_DTYPES}
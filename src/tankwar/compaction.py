@@ -0,0 +1,280 @@
+import argparse
+import glob
+import heapq
+import logging
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from itertools import islice
+from operator import itemgetter
+from typing import Iterable, Iterator
+
+import h5py
+import numpy as np
+
+from .image_codec import ImageTable
+from .session_storage import SessionStorage
+
+logger = logging.getLogger("Compaction")
+
+# One entry per table of every shard, the global index of a compacted dataset
+INDEX_DTYPE = np.dtype(
+    [
+        ("shard", np.uint32),
+        ("component", h5py.string_dtype()),
+        ("entity", np.uint64),
+        ("rows", np.uint64),
+        ("first_timestamp", np.uint64),
+        ("last_timestamp", np.uint64),
+    ]
+)
+
+
+# The session files merged into every shard
+SESSION_DTYPE = np.dtype([("shard", np.uint32), ("path", h5py.string_dtype())])
+
+
+def open_storage(path: str, mode: str = "r") -> SessionStorage:
+    directory, file_name = os.path.split(path)
+    return SessionStorage(file_name, dir=directory or ".", mode=mode)
+
+
+def plan_shards(session_paths: Iterable[str], max_shard_size: int) -> list[list[str]]:
+    """Group sessions, in path order, into shards of about `max_shard_size` bytes."""
+    shards = []
+    shard, shard_size = [], 0
+
+    for path in sorted(session_paths):
+        size = os.path.getsize(path)
+        if shard and shard_size + size > max_shard_size:
+            shards.append(shard)
+            shard, shard_size = [], 0
+
+        shard.append(path)
+        shard_size += size
+
+    if shard:
+        shards.append(shard)
+
+    return shards
+
+
+def _image_rows(
+    tables: list[h5py.Dataset | ImageTable],
+    batch_rows: int,
+) -> Iterator[tuple[int, np.ndarray]]:
+    def read(table):
+        for start in range(0, len(table), batch_rows):
+            batch = table[start : start + batch_rows]
+            yield from zip(batch["timestamp"], batch["image"])
+
+    return heapq.merge(*(read(table) for table in tables), key=itemgetter(0))
+
+
+def _compact_images(
+    shard: SessionStorage,
+    entity: int,
+    tables: list[h5py.Dataset | ImageTable],
+    chunk_bytes: int,
+) -> np.ndarray:
+    # A table holds one image shape, keep the most common one of the entity
+    by_shape: dict[tuple[int, ...], list] = {}
+    for table in tables:
+        by_shape.setdefault(table.dtype["image"].shape, []).append(table)
+
+    shape, tables = max(by_shape.items(), key=lambda item: sum(map(len, item[1])))
+    for other_shape, skipped in by_shape.items():
+        if other_shape != shape:
+            rows = sum(map(len, skipped))
+            logger.warning(
+                f"Skipping {rows} images of shape {other_shape} of entity {entity}, "
+                f"its table holds images of shape {shape}"
+            )
+
+    # Allocate once for every row, and encode and write in chunk sized batches
+    chunk_frames = max(1, chunk_bytes // int(np.prod(shape)))
+    encoder = shard.create_image_table(
+        entity,
+        shape,
+        capacity=sum(map(len, tables)),
+        chunk_frames=chunk_frames,
+    )
+
+    rows = _image_rows(tables, chunk_frames)
+    while batch := list(islice(rows, chunk_frames)):
+        timestamps, images = zip(*batch)
+        encoder.extend(np.asarray(timestamps), np.stack(images))
+
+    encoder.finish()
+    return encoder.group["rows"]["timestamp"]
+
+
+def compact_shard(
+    session_paths: list[str],
+    shard_path: str,
+    chunk_bytes: int = 1 << 20,
+) -> tuple[list[str], list[tuple]]:
+    """Merge sessions into one shard and return the merged sessions and the index.
+
+    The tables of an entity are concatenated into one table in timestamp order,
+    allocated at once with chunks of about `chunk_bytes`. Images are re-encoded
+    in batches, which also deduplicates them across sessions.
+
+    Sessions that can't be opened, such as the one a recorder is still writing
+    or a truncated one, are skipped. The shard isn't written if none is left.
+    """
+    shard = open_storage(shard_path, mode="w")
+    index = []
+
+    with ExitStack() as stack:
+        sessions, compacted = [], []
+        for path in session_paths:
+            try:
+                sessions.append(stack.enter_context(open_storage(path)))
+                compacted.append(path)
+
+            except OSError as e:
+                logger.warning(f"Skipping session {path}: {e}")
+
+        if not sessions:
+            return compacted, index
+
+        stack.enter_context(shard)
+
+        parts: dict[tuple[str, int], list] = {}
+        for session in sessions:
+            for entity_id, group in session.file.get("entities", {}).items():
+                shard.entity_data(session.id_to_entity(entity_id)).update(group.attrs)
+
+            for entity, component, table in session.tables():
+                if len(table):
+                    parts.setdefault((component, entity), []).append(table)
+
+        for (component, entity), tables in sorted(parts.items()):
+            if component == "image":
+                timestamps = _compact_images(shard, entity, tables, chunk_bytes)
+
+            else:
+                rows = np.concatenate([table[:] for table in tables])
+                rows = rows[np.argsort(rows["timestamp"], kind="stable")]
+                chunk_rows = min(len(rows), max(1, chunk_bytes // rows.dtype.itemsize))
+                shard.create_table(entity, component, rows, chunks=(chunk_rows,))
+                timestamps = rows["timestamp"]
+
+            index.append(
+                (component, entity, len(timestamps), timestamps[0], timestamps[-1])
+            )
+
+    logger.info(f"Compacted {len(compacted)} sessions into {shard_path}")
+    return compacted, index
+
+
+def compact_sessions(
+    session_paths: Iterable[str],
+    dir: str = "dataset/shards",
+    max_shard_size: int = 1 << 30,
+    chunk_bytes: int = 1 << 20,
+    max_workers: int | None = None,
+) -> str:
+    """Compact sessions into shards in parallel and return the path of their index.
+
+    The index file lists the shard files, the sessions merged into each shard
+    and, for every table in them, its component, entity, row count and time range.
+    """
+    os.makedirs(dir, exist_ok=True)
+    shards = plan_shards(session_paths, max_shard_size)
+    shard_paths = [os.path.join(dir, f"shard_{i:05d}.hdf5") for i in range(len(shards))]
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = list(
+            executor.map(
+                compact_shard,
+                shards,
+                shard_paths,
+                [chunk_bytes] * len(shards),
+            )
+        )
+
+    # Only shards with at least one merged session were written
+    results = [
+        (path, compacted, shard_index)
+        for path, (compacted, shard_index) in zip(shard_paths, results)
+        if compacted
+    ]
+    sessions = [
+        (shard, session)
+        for shard, (_, compacted, _) in enumerate(results)
+        for session in compacted
+    ]
+    entries = [
+        (shard, *entry)
+        for shard, (_, _, shard_index) in enumerate(results)
+        for entry in shard_index
+    ]
+
+    index_path = os.path.join(dir, "index.hdf5")
+    with h5py.File(index_path, "w") as file:
+        file.create_dataset(
+            "shards",
+            data=[os.path.basename(path) for path, _, _ in results],
+            dtype=h5py.string_dtype(),
+        )
+        file.create_dataset("sessions", data=np.array(sessions, dtype=SESSION_DTYPE))
+        file.create_dataset("tables", data=np.array(entries, dtype=INDEX_DTYPE))
+
+    logger.info(f"Wrote index of {len(entries)} tables to {index_path}")
+    return index_path
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="tankwar-compact",
+        description="Merge session files into repacked shards with a global index.",
+    )
+    parser.add_argument(
+        "sessions",
+        nargs="*",
+        help="session files to compact, all of dataset/sessions by default",
+    )
+    parser.add_argument("--dir", default="dataset/shards")
+    parser.add_argument(
+        "--max-shard-size",
+        type=float,
+        default=1024,
+        help="megabytes of input sessions per shard",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=float,
+        default=1024,
+        help="kilobytes per chunk of the repacked tables",
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    handler = logging.StreamHandler()
+    handler.setLevel(logging.INFO)
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(name)s %(levelname)s %(message)s",
+        handlers=[handler],
+    )
+
+    sessions = args.sessions or glob.glob("dataset/sessions/session_*.hdf5")
+    if not sessions:
+        logger.error("No session files to compact")
+        return 1
+
+    compact_sessions(
+        sessions,
+        dir=args.dir,
+        max_shard_size=int(args.max_shard_size * 1024 * 1024),
+        chunk_bytes=int(args.chunk_size * 1024),
+        max_workers=args.workers,
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,7 +5,7 @@ import cv2
 import gymnasium as gym
 import numpy as np
 
-from tankwar import client
+from tankwar import client, world_state
 
 
 class TankwarEnvException(Exception):
@@ -35,6 +35,7 @@ class TankwarEnv(gym.Env):
         client: client.GameClient | None = None,
         render_mode: str | None = None,
         ball_id: int | None = None,
+        nearest_k: int | None = None,
     ):
         super().__init__()
 
@@ -48,7 +49,7 @@ class TankwarEnv(gym.Env):
         self.client = client
         self.render_mode = render_mode
 
-        from gymnasium.spaces import Box, Dict
+        from gymnasium.spaces import Box, Dict, MultiBinary
 
         position = Dict(
             x=Box(-np.inf, np.inf, dtype=np.float32),
@@ -67,6 +68,18 @@ class TankwarEnv(gym.Env):
         if self.ball_id is not None:
             self.observation_space["ball_position"] = position
 
+        # Offsets from the player to its k nearest tanks and balls, `present`
+        # marks which of the k slots are filled
+        self.nearest_k = nearest_k
+        self.tracked_entities: set[int] = set()
+        if self.nearest_k is not None:
+            nearest = Dict(
+                position=Box(-np.inf, np.inf, shape=(nearest_k, 2), dtype=np.float32),
+                present=MultiBinary(nearest_k),
+            )
+            self.observation_space["nearest_tanks"] = nearest
+            self.observation_space["nearest_balls"] = nearest
+
         self.action_space = Dict(
             right_engine=Box(-1, 1, shape=(), dtype=np.float32),
             left_engine=Box(-1, 1, shape=(), dtype=np.float32),
@@ -152,6 +165,9 @@ class TankwarEnv(gym.Env):
         return observation, reward, terminated, truncated, info
 
     def send_update_requests(self):
+        if self.nearest_k is not None:
+            self.track_entities()
+
         if "ball_position" in self.observation_space.keys():
             self.client.request_update(self.ball_id, client.ObservationKind.POSITION)
 
@@ -167,6 +183,18 @@ class TankwarEnv(gym.Env):
         ):
             self.client.request_update(self.player_id, client.ObservationKind.IMAGE)
 
+    def track_entities(self):
+        """Subscribe to the positions of tanks and balls not tracked yet."""
+        # Copied first, the receive thread updates these
+        entities = self.client.alive_tanks.copy()
+        entities.update(self.client.balls.copy())
+        entities -= self.tracked_entities
+
+        for entity in entities:
+            self.client.subscribe(entity, client.ObservationKind.POSITION)
+
+        self.tracked_entities |= entities
+
     def render(self):
         if self.render_mode == "rgb_array":
             return self._get_image_array()
@@ -204,6 +232,8 @@ class TankwarEnv(gym.Env):
 
         obs.update(self._get_position("ball_position", self.ball_id))
         obs.update(self._get_position("player_position", self.player_id))
+        obs.update(self._get_nearest("nearest_tanks", world_state.TANK))
+        obs.update(self._get_nearest("nearest_balls", world_state.BALL))
 
         if "player_rotation" in self.observation_space.keys():
             try:
@@ -240,6 +270,28 @@ class TankwarEnv(gym.Env):
 
         return {obs_id: position}
 
+    def _get_nearest(self, obs_id, kind) -> dict[str, dict[str, np.ndarray]]:
+        if obs_id not in self.observation_space.keys():
+            return {}
+
+        position = np.zeros((self.nearest_k, 2), dtype=np.float32)
+        present = np.zeros(self.nearest_k, dtype=np.int8)
+
+        try:
+            center = self.client.world.get(self.player_id)["position"]
+
+        except KeyError:
+            center = np.full(2, np.nan, dtype=np.float32)
+
+        if np.isfinite(center).all():
+            nearest = self.client.world.nearest(
+                center, self.nearest_k, kind=kind, exclude=(self.player_id,)
+            )
+            position[: len(nearest)] = nearest["position"] - center
+            present[: len(nearest)] = 1
+
+        return {obs_id: {"position": position, "present": present}}
+
     def _get_image_array(self) -> np.ndarray:
         try:
             return self.get_latest_value(self.player_id, "image")
@@ -0,0 +1,237 @@
+import hashlib
+
+import h5py
+import numpy as np
+
+# An image table is a group holding three datasets:
+#   rows:   (timestamp, slot) for every stored frame
+#   slots:  (digest, keyframe) for every distinct frame
+#   pixels: the keyframes, and for every other slot its difference (mod 256)
+#           to its keyframe, which is mostly zeros and compresses well
+ROW_DTYPE = np.dtype([("timestamp", np.uint64), ("slot", np.uint32)])
+SLOT_DTYPE = np.dtype([("digest", np.uint8, (16,)), ("keyframe", np.uint32)])
+
+# Selecting a slot costs about as much as reading this many consecutive slots
+DENSE_SLOTS = 64
+
+
+def digest(image: np.ndarray) -> bytes:
+    return hashlib.blake2b(np.ascontiguousarray(image), digest_size=16).digest()
+
+
+class ImageTable:
+    """Read-only view of an encoded image table.
+
+    Indexing decodes the requested rows and returns them in the layout of a plain
+    table, `(timestamp, image)`, so it can be used wherever an `h5py.Dataset` is.
+    Field names select fields like they do for a dataset, `table["timestamp"]`
+    reads the timestamps without decoding any image.
+    """
+
+    def __init__(self, group: h5py.Group):
+        self.group = group
+        self.rows = group["rows"]
+        self.slots = group["slots"]
+        self.pixels = group["pixels"]
+        self.dtype = np.dtype(
+            [("timestamp", np.uint64), ("image", np.uint8, self.pixels.shape[1:])]
+        )
+
+    @property
+    def shape(self) -> tuple[int]:
+        return self.rows.shape
+
+    @property
+    def chunks(self) -> tuple[int]:
+        # Read in pixel chunks, a chunk of rows can decode to a lot of memory
+        return self.pixels.chunks[:1]
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __getitem__(self, key) -> np.ndarray | np.void:
+        # Split field names from the selection, as h5py does
+        args = key if isinstance(key, tuple) else (key,)
+        names = [arg for arg in args if isinstance(arg, str)]
+        rows = self.rows[tuple(arg for arg in args if not isinstance(arg, str))]
+
+        if names == ["timestamp"]:
+            return rows["timestamp"]
+
+        scalar = isinstance(rows, np.void)
+        rows = np.atleast_1d(rows)
+
+        data = np.empty(len(rows), dtype=self.dtype)
+        data["timestamp"] = rows["timestamp"]
+        data["image"] = self.decode(rows["slot"])
+
+        if names:
+            data = data[names[0]] if len(names) == 1 else data[names]
+
+        return data[0] if scalar else data
+
+    def decode(self, slots: np.ndarray) -> np.ndarray:
+        """Decode the images of the given slots, in the given order."""
+        unique_slots, inverse = np.unique(slots, return_inverse=True)
+        if not len(unique_slots):
+            return np.empty((0, *self.pixels.shape[1:]), dtype=np.uint8)
+
+        # Read only the requested slots, unless they are dense enough that reading
+        # the span between them is cheaper than selecting each one
+        first, last = int(unique_slots[0]), int(unique_slots[-1])
+        if last - first + 1 <= DENSE_SLOTS * len(unique_slots):
+            keyframes = self.slots[first : last + 1]["keyframe"][unique_slots - first]
+
+        else:
+            keyframes = self.slots[unique_slots]["keyframe"]
+
+        # Read every needed keyframe and delta at once, h5py wants sorted indices
+        needed = np.union1d(unique_slots, keyframes)
+        pixels = self.pixels[needed]
+        positions = {slot: i for i, slot in enumerate(needed.tolist())}
+
+        images = np.empty((len(unique_slots), *self.pixels.shape[1:]), dtype=np.uint8)
+        for i, (slot, keyframe) in enumerate(zip(unique_slots, keyframes)):
+            image = pixels[positions[int(slot)]]
+            if slot != keyframe:
+                image = np.add(pixels[positions[int(keyframe)]], image, dtype=np.uint8)
+
+            images[i] = image
+
+        return images[inverse.reshape(-1)]
+
+
+class ImageEncoder:
+    """Appends frames to an image table.
+
+    Exact repeats of an already stored frame only add a row. Other frames are
+    stored as a difference to the current keyframe, unless more than
+    `max_delta_density` of it is non-zero or `keyframe_interval` distinct frames
+    were stored since the keyframe, then the frame becomes the new keyframe.
+
+    Pixels are chunked by `chunk_frames` frames. When the number of frames is
+    known up front, `reserve` allocates the datasets once and `finish` trims
+    them to what was used.
+    """
+
+    def __init__(
+        self,
+        group: h5py.Group,
+        keyframe_interval: int = 64,
+        max_delta_density: float = 0.25,
+        compression: int = 4,
+        chunk_frames: int = 1,
+    ):
+        self.group = group
+        self.keyframe_interval = keyframe_interval
+        self.max_delta_density = max_delta_density
+        self.compression = compression
+        self.chunk_frames = chunk_frames
+
+        self.digests: dict[bytes, int] = {}
+        self.keyframe: np.ndarray | None = None
+        self.keyframe_slot = 0
+        self.row_count = 0
+        self.slot_count = 0
+
+        # Continue an existing table
+        if "slots" in group:
+            slots = group["slots"][:]
+            self.digests = {bytes(d): i for i, d in enumerate(slots["digest"])}
+            self.row_count = len(group["rows"])
+            self.slot_count = len(slots)
+
+            if len(slots):
+                self.keyframe_slot = int(slots[-1]["keyframe"])
+                self.keyframe = group["pixels"][self.keyframe_slot]
+
+    def reserve(self, image_shape: tuple[int, ...], capacity: int) -> None:
+        if "rows" not in self.group:
+            self._create_datasets(image_shape, capacity)
+
+    def _create_datasets(self, image_shape: tuple[int, ...], capacity: int = 0) -> None:
+        self.group.create_dataset(
+            "rows", shape=(capacity,), maxshape=(None,), dtype=ROW_DTYPE
+        )
+        self.group.create_dataset(
+            "slots", shape=(capacity,), maxshape=(None,), dtype=SLOT_DTYPE
+        )
+        self.group.create_dataset(
+            "pixels",
+            shape=(capacity, *image_shape),
+            maxshape=(None, *image_shape),
+            chunks=(self.chunk_frames, *image_shape),
+            dtype=np.uint8,
+            compression=self.compression,
+        )
+
+    def append(self, timestamp: int, image: np.ndarray) -> None:
+        self.extend(np.asarray([timestamp]), image[None])
+
+    def extend(self, timestamps: np.ndarray, images: np.ndarray) -> None:
+        """Append a batch of frames, with at most one write per dataset."""
+        if "rows" not in self.group:
+            self._create_datasets(images.shape[1:])
+
+        pixels = self.group["pixels"]
+        if images.shape[1:] != pixels.shape[1:]:
+            raise TypeError(
+                f"Image of shape {images.shape[1:]} doesn't fit table of "
+                f"{pixels.shape[1:]}"
+            )
+
+        rows = np.empty(len(images), dtype=ROW_DTYPE)
+        rows["timestamp"] = timestamps
+        new_pixels, new_slots = [], []
+
+        for i, image in enumerate(images):
+            image_digest = digest(image)
+            slot = self.digests.get(image_digest)
+
+            if slot is None:
+                slot = self.slot_count + len(new_pixels)
+                new_pixels.append(self._encode(slot, image))
+                new_slots.append(
+                    (np.frombuffer(image_digest, dtype=np.uint8), self.keyframe_slot)
+                )
+                self.digests[image_digest] = slot
+
+            rows["slot"][i] = slot
+
+        if new_pixels:
+            self._write(pixels, self.slot_count, np.stack(new_pixels))
+            slots = np.array(new_slots, dtype=SLOT_DTYPE)
+            self._write(self.group["slots"], self.slot_count, slots)
+            self.slot_count += len(new_pixels)
+
+        self._write(self.group["rows"], self.row_count, rows)
+        self.row_count += len(rows)
+
+    def finish(self) -> None:
+        """Trim reserved but unused space off the datasets."""
+        if "rows" not in self.group:
+            return
+
+        self.group["rows"].resize(self.row_count, axis=0)
+        self.group["slots"].resize(self.slot_count, axis=0)
+        self.group["pixels"].resize(self.slot_count, axis=0)
+
+    def _encode(self, slot: int, image: np.ndarray) -> np.ndarray:
+        since_keyframe = slot - self.keyframe_slot
+        if self.keyframe is not None and since_keyframe < self.keyframe_interval:
+            delta = np.subtract(image, self.keyframe, dtype=np.uint8)
+            if np.count_nonzero(delta) <= self.max_delta_density * delta.size:
+                return delta
+
+        # Copied, the caller may reuse the buffer for its next frame
+        self.keyframe = image.copy()
+        self.keyframe_slot = slot
+        return image
+
+    @staticmethod
+    def _write(dataset: h5py.Dataset, start: int, data: np.ndarray) -> None:
+        end = start + len(data)
+        if end > dataset.shape[0]:
+            dataset.resize(end, axis=0)
+
+        dataset[start:end] = data
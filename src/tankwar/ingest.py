@@ -0,0 +1,96 @@
+import threading
+from collections import Counter, OrderedDict
+from itertools import count
+from typing import Hashable
+
+from .protobuf.game_socket_pb2 import ServerMessage
+
+# Observation kinds where only the newest pending value of an entity matters, a
+# newer update replaces the pending one. Everything else (rewards, tank deaths
+# and assignments, lists, ...) is never dropped.
+LATEST_ONLY_KINDS = frozenset(
+    {
+        "image",
+        "position",
+        "rotation_in_radians",
+        "tank_controls",
+        "turret_controls",
+    }
+)
+
+
+class IngestQueue:
+    """Bounded staging queue between reading the socket and processing messages.
+
+    Messages come out in arrival order. A message of a latest-only kind takes
+    the place of a pending message of the same kind and entity, instead of
+    queueing behind it. Other messages block `put` while `maxsize` messages are
+    pending, which pushes back on the socket instead of letting latency grow.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 256,
+        latest_only_kinds: frozenset[str] = LATEST_ONLY_KINDS,
+    ):
+        if maxsize < 1:
+            raise ValueError(f"Ingest queue size must be positive, got {maxsize}")
+
+        self.maxsize = maxsize
+        self.latest_only_kinds = latest_only_kinds
+
+        self.condition = threading.Condition()
+        self.pending: OrderedDict[Hashable, ServerMessage] = OrderedDict()
+        self.sequence = count()
+        self.closed = False
+
+        # Number of replaced (dropped) messages per observation kind
+        self.dropped = Counter()
+
+    def _key(self, message: ServerMessage) -> tuple[Hashable, str | None]:
+        if message.WhichOneof("message") == "observation_update":
+            update = message.observation_update
+            kind = update.WhichOneof("observation")
+            if kind in self.latest_only_kinds:
+                return (kind, update.entity), kind
+
+        return next(self.sequence), None
+
+    def put(self, message: ServerMessage) -> None:
+        key, kind = self._key(message)
+
+        with self.condition:
+            if kind is not None and key in self.pending:
+                self.pending[key] = message
+                self.dropped[kind] += 1
+                return
+
+            while len(self.pending) >= self.maxsize and not self.closed:
+                self.condition.wait()
+
+            if self.closed:
+                return
+
+            self.pending[key] = message
+            self.condition.notify_all()
+
+    def get(self) -> ServerMessage | None:
+        """Next pending message, or `None` once the queue is closed and drained."""
+        with self.condition:
+            while not self.pending and not self.closed:
+                self.condition.wait()
+
+            if not self.pending:
+                return None
+
+            _, message = self.pending.popitem(last=False)
+            self.condition.notify_all()
+            return message
+
+    def close(self) -> None:
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def __len__(self) -> int:
+        return len(self.pending)
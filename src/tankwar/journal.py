@@ -0,0 +1,243 @@
+import logging
+import os
+import struct
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator
+
+import numpy as np
+
+from .session_storage import SessionStorage
+
+logger = logging.getLogger("Journal")
+
+# A journal file starts with the magic bytes and a compression flag, followed by
+# blocks of length-delimited frames exactly as they were read from the socket:
+#     block := payload_size: u32, frame_count: u32, payload
+# Every block is listed in a sparse `<journal>.idx` sidecar file:
+#     index_entry := block_offset: u64, first_frame: u64
+MAGIC = b"TWJ\x01"
+HEADER = struct.Struct("<4sB")
+BLOCK_HEADER = struct.Struct("<II")
+INDEX_ENTRY = np.dtype([("offset", "<u8"), ("first_frame", "<u8")])
+
+# Tag of ServerMessage.observation_update (field 1, length-delimited), a oneof
+# member is the only field of the message, so the tag is always the first byte
+OBSERVATION_UPDATE_TAG = 0x0A
+
+
+def encode_varint(number: int) -> bytes:
+    varint_buf = []
+
+    while number >> 7:
+        varint_buf.append(number & 0x7F | 0x80)
+        number >>= 7
+
+    varint_buf.append(number)
+    return bytes(varint_buf)
+
+
+def decode_varint(buffer: bytes, offset: int = 0) -> tuple[int, int]:
+    """Return the decoded number and the offset just past it."""
+    shift = 0
+    number = 0
+    while True:
+        i = buffer[offset]
+        offset += 1
+        number |= (i & 0x7F) << shift
+        shift += 7
+        if not (i & 0x80):
+            return number, offset
+
+
+def is_observation_update(frame: bytes) -> bool:
+    return len(frame) > 0 and frame[0] == OBSERVATION_UPDATE_TAG
+
+
+class JournalWriter:
+    """Append-only journal of raw server frames.
+
+    Frames are buffered into blocks of about `block_size` bytes, which are
+    zlib-compressed when `compression_level` is set.
+    """
+
+    def __init__(
+        self,
+        file_name: str | None = None,
+        dir: str = "dataset/journals",
+        compression_level: int | None = None,
+        block_size: int = 1 << 20,
+    ):
+        os.makedirs(dir, exist_ok=True)
+
+        if file_name is None:
+            file_name = f"journal_{os.urandom(4).hex()}.twj"
+
+        self.file_path = os.path.join(dir, file_name)
+        self.compression_level = compression_level
+        self.block_size = block_size
+
+        self.file = None
+        self.index_file = None
+        self.lock = threading.Lock()
+        self.block = bytearray()
+        self.block_frames = 0
+        self.frame_count = 0
+
+    def __enter__(self) -> "JournalWriter":
+        self.open()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def open(self) -> None:
+        self.file = open(self.file_path, "wb")
+        self.index_file = open(self.file_path + ".idx", "wb")
+        self.file.write(HEADER.pack(MAGIC, self.compression_level is not None))
+        self.file.flush()
+        logger.info(f"Opened journal {self.file_path}")
+
+    def close(self) -> None:
+        with self.lock:
+            if self.file is None:
+                return
+
+            self._write_block()
+            self.file = self.file.close()
+            self.index_file = self.index_file.close()
+            logger.info(f"Closed journal {self.file_path}")
+
+    def append(self, frame: bytes) -> None:
+        with self.lock:
+            if self.file is None:
+                raise RuntimeError("Journal is closed.")
+
+            self.block += encode_varint(len(frame))
+            self.block += frame
+            self.block_frames += 1
+
+            if len(self.block) >= self.block_size:
+                self._write_block()
+
+    def flush(self) -> None:
+        with self.lock:
+            self._write_block()
+
+    def _write_block(self) -> None:
+        if not self.block_frames:
+            return
+
+        payload = self.block
+        if self.compression_level is not None:
+            payload = zlib.compress(payload, self.compression_level)
+
+        entry = np.array((self.file.tell(), self.frame_count), dtype=INDEX_ENTRY)
+        self.index_file.write(entry.tobytes())
+        self.file.write(BLOCK_HEADER.pack(len(payload), self.block_frames))
+        self.file.write(payload)
+
+        # Hand every complete block to the OS, so it survives the process
+        self.file.flush()
+        self.index_file.flush()
+
+        self.frame_count += self.block_frames
+        self.block = bytearray()
+        self.block_frames = 0
+
+
+class JournalReader:
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+
+    def read_index(self) -> np.ndarray:
+        try:
+            index = np.fromfile(self.file_path + ".idx", dtype=INDEX_ENTRY)
+
+        except FileNotFoundError:
+            index = np.zeros(0, dtype=INDEX_ENTRY)
+
+        # The last entry may point to a block that was never completely written
+        return index[index["offset"] < os.path.getsize(self.file_path)]
+
+    def frames(self, start: int = 0) -> Iterator[bytes]:
+        """Yield the raw frames of the journal, beginning at frame number `start`."""
+        index = self.read_index()
+        block = max(np.searchsorted(index["first_frame"], start, side="right") - 1, 0)
+
+        with open(self.file_path, "rb") as file:
+            header = file.read(HEADER.size)
+            if len(header) < HEADER.size:
+                logger.warning(f"Ignoring truncated journal {self.file_path}")
+                return
+
+            magic, compressed = HEADER.unpack(header)
+            if magic != MAGIC:
+                raise ValueError(f"{self.file_path} is not a journal file")
+
+            frame_number = 0
+            if len(index):
+                file.seek(index[block]["offset"])
+                frame_number = int(index[block]["first_frame"])
+
+            while header := file.read(BLOCK_HEADER.size):
+                if len(header) < BLOCK_HEADER.size:
+                    break
+
+                payload_size, frame_count = BLOCK_HEADER.unpack(header)
+                payload = file.read(payload_size)
+                if len(payload) < payload_size:
+                    logger.warning(f"Ignoring truncated block in {self.file_path}")
+                    break
+
+                if compressed:
+                    payload = zlib.decompress(payload)
+
+                offset = 0
+                view = memoryview(payload)
+                for _ in range(frame_count):
+                    length, offset = decode_varint(payload, offset)
+                    if frame_number >= start:
+                        yield view[offset : offset + length]
+
+                    offset += length
+                    frame_number += 1
+
+    def __iter__(self) -> Iterator[bytes]:
+        return self.frames()
+
+
+def convert_journal(journal_path: str, dir: str = "dataset/sessions") -> str:
+    """Replay a journal into a new `SessionStorage` file and return its path."""
+    # Imported here, since the client imports this module for its recording mode
+    from .client import GameClient, ServerMessage
+
+    stem, _ = os.path.splitext(os.path.basename(journal_path))
+    file_name = f"session_{stem.removeprefix('journal_')}.hdf5"
+    storage = SessionStorage(file_name, dir=dir, mode="w")
+    client = GameClient(storage=storage)
+
+    message = ServerMessage()
+
+    with storage:
+        for frame in JournalReader(journal_path):
+            message.ParseFromString(frame)
+            client.process_server_message(message)
+
+    client.sock.close()
+    logger.info(f"Converted {journal_path} to {storage.file_path}")
+    return storage.file_path
+
+
+def convert_journals(
+    journal_paths: Iterable[str],
+    dir: str = "dataset/sessions",
+    max_workers: int | None = None,
+) -> list[str]:
+    """Convert many journals to session files in parallel, one process per journal."""
+    journal_paths = list(journal_paths)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        dirs = [dir] * len(journal_paths)
+        return list(executor.map(convert_journal, journal_paths, dirs))
@@ -0,0 +1,232 @@
+import heapq
+import os
+import queue
+import threading
+import time
+from operator import itemgetter
+from typing import Iterator
+
+import h5py
+import numpy as np
+
+from .client import GameClient, encode_image, read_server_messages
+from .protobuf.game_socket_pb2 import *
+from .session_storage import SessionStorage
+
+
+def encode_observation(
+    entity: int,
+    component: str,
+    timestamp: int,
+    value: np.ndarray,
+) -> ObservationUpdate:
+    """Inverse of `GameClient.handle_observation_update` for a single stored row."""
+    update = ObservationUpdate(entity=entity, timestamp=timestamp)
+
+    if component == "image":
+        update.image.CopyFrom(encode_image(value))
+
+    elif component == "reward":
+        # The reward reason is not stored, so it can't be played back
+        update.reward.reward = float(value)
+
+    elif component == "position":
+        update.position.x = float(value["x"])
+        update.position.y = float(value["y"])
+
+    elif component == "tank_controls":
+        update.tank_controls.right_engine = float(value["right_engine"])
+        update.tank_controls.left_engine = float(value["left_engine"])
+
+    elif component == "turret_controls":
+        update.turret_controls.rotation_speed = float(value["rotation_speed"])
+        update.turret_controls.count = int(value["count"])
+
+    elif component == "rotation_in_radians":
+        update.rotation_in_radians = float(value)
+
+    else:
+        raise NotImplementedError(f"Playing back {component} is not supported yet")
+
+    return update
+
+
+def _read_rows(
+    entity: int,
+    component: str,
+    dataset: h5py.Dataset,
+    chunk_size: int | None,
+) -> Iterator[tuple[int, int, str, np.ndarray]]:
+    # Read in the dataset's own chunks, so only one chunk per table is in memory
+    if chunk_size is None:
+        chunk_size = dataset.chunks[0] if dataset.chunks else 1024
+
+    for start in range(0, len(dataset), chunk_size):
+        chunk = dataset[start : start + chunk_size]
+        for timestamp, value in zip(chunk["timestamp"], chunk[component]):
+            yield int(timestamp), entity, component, value
+
+
+def read_session(
+    storage: SessionStorage,
+    chunk_size: int | None = None,
+) -> Iterator[ServerMessage]:
+    """Stream every stored row of a session as a `ServerMessage`, in timestamp order.
+
+    Rows with equal timestamps keep the (deterministic) order of the tables in the file.
+    """
+    tables = sorted(storage.tables(), key=lambda table: (table[1], table[0]))
+    rows = heapq.merge(
+        *(_read_rows(*table, chunk_size) for table in tables),
+        key=itemgetter(0),
+    )
+
+    for timestamp, entity, component, value in rows:
+        update = encode_observation(entity, component, timestamp, value)
+        yield ServerMessage(observation_update=update)
+
+
+def recorded_tanks(storage: SessionStorage) -> TankList:
+    tank_list = TankList()
+
+    for entity_id, group in storage.file.get("entities", {}).items():
+        tank = tank_list.tanks.add(tank_id=storage.id_to_entity(entity_id))
+        for turret in group.attrs.get("turrets", []):
+            tank.turrets.add(turret_id=int(turret["turret_id"]))
+
+    return tank_list
+
+
+def recorded_balls(storage: SessionStorage, tank_list: TankList) -> BallList:
+    # Balls are not stored explicitly, every positioned entity that is not a tank
+    # is taken to be a ball
+    tank_ids = {tank.tank_id for tank in tank_list.tanks}
+    ball_ids = {
+        entity
+        for entity, component, _ in storage.tables()
+        if component == "position" and entity not in tank_ids
+    }
+
+    return BallList(balls=[Ball(ball_id=ball_id) for ball_id in sorted(ball_ids)])
+
+
+class PlaybackClient(GameClient):
+    """A `GameClient` that replays a recorded session instead of talking to a server.
+
+    `speed` scales the recorded timing (1.0 is real-time), `None` replays as fast as
+    possible. `timestamp_resolution` is the duration of one timestamp tick in seconds.
+    The replayed stream is stored into `storage`, a new file in `dataset/playback`
+    by default.
+    Control messages are accepted and ignored, spawn requests hand out recorded tanks.
+    """
+
+    def __init__(
+        self,
+        session_path: str,
+        speed: float | None = 1.0,
+        timestamp_resolution: float = 1e-3,
+        chunk_size: int | None = None,
+        storage: SessionStorage | None = None,
+    ):
+        if speed is not None and speed <= 0:
+            raise ValueError(f"Playback speed must be positive, got {speed}")
+
+        # Replays are kept apart from recorded sessions, so they aren't compacted
+        # together with the sessions they were replayed from
+        if storage is None:
+            storage = SessionStorage(dir="dataset/playback", mode="a")
+
+        super().__init__(address=None, storage=storage)
+
+        directory, file_name = os.path.split(session_path)
+        self.source = SessionStorage(file_name, dir=directory or ".", mode="r")
+        self.speed = speed
+        self.timestamp_resolution = timestamp_resolution
+        self.chunk_size = chunk_size
+
+        # Answers to client requests, served before the recorded stream
+        self.replies = queue.Queue()
+        self.recording: Iterator[ServerMessage] | None = None
+        self.tank_list = TankList()
+        self.ball_list = BallList()
+        self.spawnable_tanks = queue.Queue()
+
+    def open(self):
+        self.source.open()
+        self.storage.open()
+
+        self.tank_list = recorded_tanks(self.source)
+        self.ball_list = recorded_balls(self.source, self.tank_list)
+        for tank in self.tank_list.tanks:
+            self.spawnable_tanks.put(tank.tank_id)
+
+        self.recording = self._paced(read_session(self.source, self.chunk_size))
+        self.request_tank_list()
+        self.request_ball_list()
+        self.running = True
+
+    def connect(self):
+        self.open()
+        self.receive_thread = threading.Thread(
+            target=read_server_messages,
+            args=(self,),
+            daemon=True,
+        )
+        self.receive_thread.start()
+
+    def run(self):
+        """Replay the whole session on the calling thread, deterministically."""
+        self.open()
+        read_server_messages(self)
+
+    def close(self):
+        super().close()
+        self.source.close()
+
+    def _paced(self, messages: Iterator[ServerMessage]) -> Iterator[ServerMessage]:
+        start = None
+
+        for message in messages:
+            if self.speed is not None:
+                timestamp = message.observation_update.timestamp
+                if start is None:
+                    start = (timestamp, time.monotonic())
+
+                elapsed = (timestamp - start[0]) * self.timestamp_resolution
+                delay = start[1] + elapsed / self.speed - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+            yield message
+
+    def send_message(self, client_message: ClientMessage) -> None:
+        request = client_message.WhichOneof("message")
+
+        if request == "tanks_list_request":
+            self.replies.put(ServerMessage(tank_list=self.tank_list))
+
+        elif request == "ball_list_request":
+            self.replies.put(ServerMessage(ball_list=self.ball_list))
+
+        elif request == "spawn_tank_request":
+            try:
+                tank_id = self.spawnable_tanks.get(block=False)
+                self.replies.put(ServerMessage(tank_assigned=tank_id))
+
+            except queue.Empty:
+                pass
+
+        # Controls, subscriptions and observation requests can't change a recording
+
+    def receive_message(self) -> ServerMessage | None:
+        try:
+            return self.replies.get(block=False)
+
+        except queue.Empty:
+            pass
+
+        try:
+            return next(self.recording)
+
+        except StopIteration:
+            raise ConnectionAbortedError
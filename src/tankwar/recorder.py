@@ -0,0 +1,296 @@
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+from .client import GameClient
+from .journal import JournalWriter
+from .protobuf.game_socket_pb2 import *
+from .session_storage import SessionStorage
+
+logger = logging.getLogger("Recorder")
+
+
+class RecordingClient(GameClient):
+    """Subscribes to every tank and ball it hears of and records them continuously.
+
+    The session file (or journal, when journaling) is rolled over to a new file once
+    it grows past `max_file_size` bytes or has been open for `max_file_age` seconds.
+    Files go to `dir`, `dataset/sessions` by default or `dataset/journals` when
+    journaling, which records no session file at all.
+    """
+
+    def __init__(
+        self,
+        address=("localhost", 7878),
+        tank_kinds: list[ObservationKind] = (),
+        ball_kinds: list[ObservationKind] = (),
+        cooldown: float | None = 0.0,
+        dir: str | None = None,
+        max_file_size: int | None = None,
+        max_file_age: float | None = None,
+        journal_compression: int | None = None,
+        journaling: bool = False,
+        ingest_queue_size: int | None = None,
+    ):
+        if dir is None:
+            dir = "dataset/journals" if journaling else "dataset/sessions"
+
+        self.dir = dir
+        self.journal_compression = journal_compression
+        super().__init__(
+            address,
+            storage=None if journaling else SessionStorage(dir=dir, mode="a"),
+            journal=self._new_journal() if journaling else None,
+            ingest_queue_size=ingest_queue_size,
+        )
+
+        self.tank_kinds = list(tank_kinds)
+        self.ball_kinds = list(ball_kinds)
+        self.cooldown = cooldown
+        self.subscribed: set[int] = set()
+
+        self.max_file_size = max_file_size
+        self.max_file_age = max_file_age
+        self.file_opened_at = time.monotonic()
+        self.last_rotation_check = self.file_opened_at
+
+    def close(self):
+        # Stop the reader before closing the files, it may be in the middle of
+        # processing a message or rotating them
+        self.running = False
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+
+        except OSError:
+            pass
+
+        # It may also be blocked on a full queue
+        if self.message_queue is not None:
+            self.message_queue.close()
+
+        if self.receive_thread is not None:
+            self.receive_thread.join()
+
+        # Joins the processing thread before closing the files
+        super().close()
+
+    def _new_journal(self) -> JournalWriter:
+        return JournalWriter(dir=self.dir, compression_level=self.journal_compression)
+
+    def subscribe_all(self, entity: int, kinds: list[ObservationKind]) -> None:
+        if entity in self.subscribed:
+            return
+
+        self.subscribed.add(entity)
+        for kind in kinds:
+            self.subscribe(entity, kind, self.cooldown)
+
+    def handle_tank_spawned(self, tank: Tank):
+        super().handle_tank_spawned(tank)
+        self.subscribe_all(tank.tank_id, self.tank_kinds)
+
+    def handle_ball_list(self, ball_list: BallList):
+        super().handle_ball_list(ball_list)
+        for ball_id in self.balls:
+            self.subscribe_all(ball_id, self.ball_kinds)
+
+    def process_server_message(self, message: ServerMessage):
+        # Rotation runs on the receive thread, which may not be the processing one
+        with self.lock:
+            super().process_server_message(message)
+
+    def receive_message(self) -> ServerMessage | None:
+        message = super().receive_message()
+
+        # Checking the file size is a syscall, so check at most once a second
+        now = time.monotonic()
+        if now - self.last_rotation_check >= 1.0:
+            self.last_rotation_check = now
+            if self.should_rotate(now):
+                self.rotate()
+
+            # Balls aren't announced when they appear, so keep asking for them.
+            # Sent under the lock, so it doesn't interleave with subscriptions.
+            with self.lock:
+                self.request_ball_list()
+
+        return message
+
+    def recording_path(self) -> str:
+        recording = self.storage if self.journal is None else self.journal
+        return recording.file_path
+
+    def should_rotate(self, now: float) -> bool:
+        age = now - self.file_opened_at
+        if self.max_file_age is not None and age >= self.max_file_age:
+            return True
+
+        if self.max_file_size is not None:
+            return os.path.getsize(self.recording_path()) >= self.max_file_size
+
+        return False
+
+    def rotate(self) -> None:
+        """Close the current files and continue recording into new ones."""
+        logger.info(f"Rolling over {self.recording_path()}")
+
+        with self.lock:
+            self._rotate()
+
+    def _rotate(self) -> None:
+        if self.journal is not None:
+            self._rotate_journal()
+
+        else:
+            self._rotate_storage()
+
+        self.file_opened_at = time.monotonic()
+
+    def _rotate_storage(self) -> None:
+        self.storage.close()
+        self.storage = SessionStorage(dir=self.dir, mode="a")
+        self.storage.open()
+
+        # Every file describes the tanks that are alive in it
+        for tank_id in self.alive_tanks:
+            turrets = self.tank_turrets.get(tank_id)
+            if turrets is not None:
+                self.storage.entity_data(tank_id)["turrets"] = turrets
+
+    def _rotate_journal(self) -> None:
+        self.journal.close()
+        self.journal = self._new_journal()
+        self.journal.open()
+
+        # Every journal starts with the tanks that are alive in it, so it converts
+        # to a session on its own
+        tank_list = TankList(
+            tanks=[
+                Tank(
+                    tank_id=tank_id,
+                    turrets=[
+                        Turret(turret_id=int(turret_id))
+                        for turret_id in self.tank_turrets[tank_id]["turret_id"]
+                    ],
+                )
+                for tank_id in self.alive_tanks
+                if tank_id in self.tank_turrets
+            ]
+        )
+        self.journal.append(ServerMessage(tank_list=tank_list).SerializeToString())
+
+
+def _stop(signum, frame):
+    raise KeyboardInterrupt
+
+
+def parse_kinds(names: list[str]) -> list[ObservationKind]:
+    return [ObservationKind.Value(name.upper()) for name in names]
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="tankwar-record",
+        description="Record every tank and ball of a tankwar server.",
+    )
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=7878)
+    parser.add_argument(
+        "--tank-kinds",
+        nargs="+",
+        default=["image", "position", "rotation", "rewards"],
+        help="observation kinds to subscribe every tank to",
+    )
+    parser.add_argument(
+        "--ball-kinds",
+        nargs="+",
+        default=["position"],
+        help="observation kinds to subscribe every ball to",
+    )
+    parser.add_argument("--cooldown", type=float, default=0.0)
+    parser.add_argument(
+        "--dir",
+        default=None,
+        help="dataset/sessions by default, dataset/journals with --journal",
+    )
+    parser.add_argument(
+        "--max-file-size",
+        type=float,
+        default=None,
+        help="roll over to a new file after this many megabytes",
+    )
+    parser.add_argument(
+        "--max-file-age",
+        type=float,
+        default=None,
+        help="roll over to a new file after this many seconds",
+    )
+    parser.add_argument(
+        "--journal",
+        action="store_true",
+        help="record raw frames into journals instead of session files",
+    )
+    parser.add_argument(
+        "--journal-compression",
+        type=int,
+        default=None,
+        help="zlib level for journal blocks",
+    )
+    parser.add_argument(
+        "--ingest-queue-size",
+        type=int,
+        default=None,
+        help="process messages on their own thread through a bounded queue that "
+        "keeps only the newest image, position, rotation and controls per entity",
+    )
+    args = parser.parse_args(argv)
+
+    # The storage logs every row at debug level
+    handler = logging.StreamHandler()
+    handler.setLevel(logging.INFO)
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(name)s %(levelname)s %(message)s",
+        handlers=[handler],
+    )
+
+    max_file_size = None
+    if args.max_file_size is not None:
+        max_file_size = int(args.max_file_size * 1024 * 1024)
+
+    client = RecordingClient(
+        (args.host, args.port),
+        tank_kinds=parse_kinds(args.tank_kinds),
+        ball_kinds=parse_kinds(args.ball_kinds),
+        cooldown=args.cooldown,
+        dir=args.dir,
+        max_file_size=max_file_size,
+        max_file_age=args.max_file_age,
+        journal_compression=args.journal_compression,
+        journaling=args.journal,
+        ingest_queue_size=args.ingest_queue_size,
+    )
+
+    # Supervisors stop the process with SIGTERM, close the files like on Ctrl-C
+    signal.signal(signal.SIGTERM, _stop)
+
+    with client:
+        logger.info(f"Recording {args.host}:{args.port} into {client.dir}")
+        try:
+            while client.running:
+                time.sleep(1.0)
+
+        except KeyboardInterrupt:
+            logger.info("Stopped recording")
+            return 0
+
+    logger.error("Lost the connection to the server")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,13 @@
 import base64
 import logging
 import os
+from typing import Iterator
 
 import h5py
 import numpy as np
 
+from .image_codec import ImageEncoder, ImageTable
+
 # Set up logger
 logger = logging.getLogger("SessionStorage")
 logger.setLevel(logging.DEBUG)  # Uncomment to enable logging
@@ -27,6 +30,10 @@ class SessionStorage:
         self.file_path = os.path.join(dir, file_name)
         self.file: h5py.File | None = None
         self.mode = mode
+        self.image_encoders: dict[str, ImageEncoder] = {}
+
+        # Open tables by (component, entity), to skip the lookups on every row
+        self.datasets: dict[tuple[str, int], h5py.Dataset] = {}
 
     def __enter__(self) -> "SessionStorage":
         self.open()
@@ -51,6 +58,8 @@ class SessionStorage:
     def close(self) -> None:
         if self.file is not None:
             self.file = self.file.__exit__()
+            self.image_encoders.clear()
+            self.datasets.clear()
             logger.info(f"Closed file {self.file_path}")
 
     def entities_with(self, component: str):
@@ -59,15 +68,32 @@ class SessionStorage:
 
         return self.file.require_group(component)
 
-    def get_table(self, entity: int, component: str) -> h5py.Dataset:
+    def get_table(self, entity: int, component: str) -> h5py.Dataset | ImageTable:
         component_group = self.entities_with(component)
 
         try:
-            return component_group[self._entity_to_id(entity)]
+            return self._as_table(component_group[self._entity_to_id(entity)])
 
         except KeyError:
             raise KeyError(f"Dataset {entity}/{component} not found.")
 
+    def components(self) -> list[str]:
+        if self.file is None:
+            raise RuntimeError("File is not opened.")
+
+        return [name for name in self.file.keys() if name != "entities"]
+
+    def tables(self) -> Iterator[tuple[int, str, h5py.Dataset | ImageTable]]:
+        """Yield `(entity, component, dataset)` for every table in the file."""
+        for component in self.components():
+            for entity_id, node in self.file[component].items():
+                yield self.id_to_entity(entity_id), component, self._as_table(node)
+
+    @staticmethod
+    def _as_table(node: h5py.Dataset | h5py.Group) -> h5py.Dataset | ImageTable:
+        # Encoded image tables are groups, plain tables are datasets
+        return ImageTable(node) if isinstance(node, h5py.Group) else node
+
     def add_row(
         self,
         entity: int,
@@ -79,6 +105,27 @@ class SessionStorage:
         if self.file is None:
             raise RuntimeError("File is closed.")
 
+        # Images are deduplicated and delta encoded, except when appending to a
+        # plain image table from an older file
+        if component == "image":
+            entity_id = self._entity_to_id(entity)
+            encoder = self.image_encoders.get(entity_id)
+            component_group = self.file.require_group(component)
+
+            if encoder is None and not isinstance(
+                component_group.get(entity_id), h5py.Dataset
+            ):
+                encoder = ImageEncoder(
+                    component_group.require_group(entity_id),
+                    compression=kwargs.get("compression", 4),
+                )
+                self.image_encoders[entity_id] = encoder
+
+            if encoder is not None:
+                encoder.append(timestamp, data)
+                logger.debug("Appended data to %s/%s", entity, component)
+                return
+
         data_point = np.array(
             (timestamp, data),
             dtype=[
@@ -87,26 +134,76 @@ class SessionStorage:
             ],
         )
 
-        component_group = self.file.require_group(component)
-        entity_id = self._entity_to_id(entity)
-
         if component == "image":
             # Enable level 4 gzip compression for dataset
             kwargs.setdefault("compression", 4)
 
-        # Create or access the dataset
-        dataset = component_group.require_dataset(
-            entity_id,
-            shape=(0,),
+        self.add_record(entity, component, data_point, **kwargs)
+        logger.debug("Appended data to %s/%s", entity, component)
+
+    def add_record(
+        self,
+        entity: int,
+        component: str,
+        record: np.ndarray,
+        **kwargs,
+    ) -> None:
+        """Append a prebuilt `(timestamp, component)` row, without any conversion."""
+        dataset = self.datasets.get((component, entity))
+
+        if dataset is None:
+            if self.file is None:
+                raise RuntimeError("File is closed.")
+
+            # Create or access the dataset
+            dataset = self.file.require_group(component).require_dataset(
+                self._entity_to_id(entity),
+                shape=(0,),
+                maxshape=(None,),
+                dtype=record.dtype,
+                **kwargs,
+            )
+            self.datasets[(component, entity)] = dataset
+
+        # Append new data as structured array
+        dataset.resize(dataset.shape[0] + 1, axis=0)
+        dataset[-1] = record
+
+    def create_table(
+        self,
+        entity: int,
+        component: str,
+        rows: np.ndarray,
+        **kwargs,
+    ) -> h5py.Dataset:
+        """Write a whole table of `(timestamp, component)` rows at once."""
+        if self.file is None:
+            raise RuntimeError("File is closed.")
+
+        return self.file.require_group(component).create_dataset(
+            self._entity_to_id(entity),
+            data=rows,
             maxshape=(None,),
-            dtype=data_point.dtype,
             **kwargs,
         )
 
-        # Append new data as structured array
-        dataset.resize(dataset.shape[0] + 1, axis=0)
-        dataset[-1] = data_point
-        logger.debug(f"Appended data to {entity}/{component}")
+    def create_image_table(
+        self,
+        entity: int,
+        image_shape: tuple[int, ...],
+        capacity: int,
+        **kwargs,
+    ) -> ImageEncoder:
+        """Allocate an image table for `capacity` frames, to be filled in bulk."""
+        if self.file is None:
+            raise RuntimeError("File is closed.")
+
+        entity_id = self._entity_to_id(entity)
+        group = self.file.require_group("image").create_group(entity_id)
+        encoder = ImageEncoder(group, **kwargs)
+        encoder.reserve(image_shape, capacity)
+        self.image_encoders[entity_id] = encoder
+        return encoder
 
     def entity_data(self, entity: int) -> h5py.AttributeManager:
         group = self.file.require_group("entities")
@@ -117,6 +214,7 @@ class SessionStorage:
         byte_rep = entity.to_bytes(8, "little")
         return base64.b64encode(byte_rep).decode("utf-8")
 
+    @staticmethod
     def id_to_entity(entity_id: bytes) -> int:
         decoded_bytes = base64.b64decode(entity_id)
         return int.from_bytes(decoded_bytes, "little")
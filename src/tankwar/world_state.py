@@ -0,0 +1,142 @@
+import threading
+from typing import Iterable
+
+import numpy as np
+
+# Kinds of tracked entities
+UNKNOWN = 0
+TANK = 1
+BALL = 2
+
+# Unknown positions and rotations are NaN, so they drop out of distance queries
+ENTITY_DTYPE = np.dtype(
+    [
+        ("entity", np.uint64),
+        ("kind", np.uint8),
+        ("position", np.float32, (2,)),
+        ("position_timestamp", np.uint64),
+        ("rotation", np.float32),
+        ("rotation_timestamp", np.uint64),
+    ]
+)
+
+
+class WorldState:
+    """Latest position and rotation of every known entity, one row per entity.
+
+    Rows are updated in place as observations arrive, and queries work on the
+    whole table at once. Queries return copies, safe to use from other threads.
+    """
+
+    def __init__(self, capacity: int = 64):
+        self.table = np.zeros(capacity, dtype=ENTITY_DTYPE)
+        self.size = 0
+        self.rows: dict[int, int] = {}
+        self.lock = threading.Lock()
+
+    def _row(self, entity: int) -> int:
+        row = self.rows.get(entity)
+        if row is not None:
+            return row
+
+        # Grow by doubling
+        if self.size == len(self.table):
+            table = np.zeros(max(1, 2 * len(self.table)), dtype=ENTITY_DTYPE)
+            table[: self.size] = self.table[: self.size]
+            self.table = table
+
+        row = self.size
+        self.table[row] = (entity, UNKNOWN, (np.nan, np.nan), 0, np.nan, 0)
+        self.rows[entity] = row
+        self.size += 1
+        return row
+
+    def set_kind(self, entity: int, kind: int) -> None:
+        with self.lock:
+            self.table["kind"][self._row(entity)] = kind
+
+    def update_position(self, entity: int, timestamp: int, x: float, y: float) -> None:
+        with self.lock:
+            row = self._row(entity)
+            self.table["position"][row] = (x, y)
+            self.table["position_timestamp"][row] = timestamp
+
+    def update_rotation(self, entity: int, timestamp: int, rotation: float) -> None:
+        with self.lock:
+            row = self._row(entity)
+            self.table["rotation"][row] = rotation
+            self.table["rotation_timestamp"][row] = timestamp
+
+    def remove(self, entity: int) -> None:
+        with self.lock:
+            row = self.rows.pop(entity, None)
+            if row is None:
+                return
+
+            # Move the last row into the gap, to keep the table dense
+            self.size -= 1
+            if row != self.size:
+                self.table[row] = self.table[self.size]
+                self.rows[int(self.table["entity"][row])] = row
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __contains__(self, entity: int) -> bool:
+        return entity in self.rows
+
+    def get(self, entity: int) -> np.void:
+        with self.lock:
+            row = self.rows.get(entity)
+            if row is None:
+                raise KeyError(f"Entity {entity} is not tracked.")
+
+            return self.table[row].copy()
+
+    def snapshot(self) -> np.ndarray:
+        with self.lock:
+            return self.table[: self.size].copy()
+
+    def _select(self, kind: int | None, exclude: Iterable[int]) -> np.ndarray:
+        with self.lock:
+            rows = self.table[: self.size]
+            mask = np.isfinite(rows["position"]).all(axis=1)
+
+            if kind is not None:
+                mask &= rows["kind"] == kind
+
+            for entity in exclude:
+                row = self.rows.get(entity)
+                if row is not None:
+                    mask[row] = False
+
+            return rows[mask]
+
+    def nearest(
+        self,
+        point: np.ndarray,
+        k: int,
+        kind: int | None = None,
+        exclude: Iterable[int] = (),
+    ) -> np.ndarray:
+        """Up to `k` entities with a known position, nearest to `point` first."""
+        rows = self._select(kind, exclude)
+        distances = np.square(rows["position"] - point).sum(axis=1)
+
+        if k < len(rows):
+            closest = np.argpartition(distances, k)[:k]
+            rows, distances = rows[closest], distances[closest]
+
+        return rows[np.argsort(distances, kind="stable")]
+
+    def within_radius(
+        self,
+        point: np.ndarray,
+        radius: float,
+        kind: int | None = None,
+        exclude: Iterable[int] = (),
+    ) -> np.ndarray:
+        """Every entity with a known position at most `radius` away from `point`."""
+        rows = self._select(kind, exclude)
+        distances = np.square(rows["position"] - point).sum(axis=1)
+        return rows[distances <= radius * radius]